@@ -1,4 +1,6 @@
+import base64
 import config
+import functools
 import PySimpleGUI as sg
 from tkinter import messagebox
 from typing import List, Dict
@@ -18,17 +20,28 @@ ROW_WIDTH = 65
 FONT_SIZE = {"default": 13, "h1": 28, "h2": 22}
 MAX_ACHIEVEMENTS = 5
 
+ACHIEVEMENT_TYPE_NAMES = [a.name for a in AchievementType]
+ACHIEVEMENT_STATUS_NAMES = [a.name for a in AchievementStatus]
+DIFFICULTY_NAMES = [d.name for d in Difficulty]
+
+
+@functools.cache
+def trash_image():
+    # Read on first use and shared by every achievement row
+    with open("./assets/images/trash.png", "rb") as image:
+        return base64.b64encode(image.read())
+
 
 def achievement_layout(i):
     return [
         sg.In(s=int(ROW_WIDTH * 0.5), key=("-SCENARIO_ACHIEVEMENT_NAME-", i)),
         sg.OptionMenu(
-            values=[a.name for a in AchievementType],
+            values=ACHIEVEMENT_TYPE_NAMES,
             key=("-SCENARIO_ACHIEVEMENT_TYPE-", i),
             default_value=AchievementType.GROUP.name,
         ),
         sg.OptionMenu(
-            values=[a.name for a in AchievementStatus],
+            values=ACHIEVEMENT_STATUS_NAMES,
             key=("-SCENARIO_ACHIEVEMENT_STATUS-", i),
             default_value=AchievementStatus.CLOSED.name,
         ),
@@ -45,25 +58,36 @@ def achievement_layout(i):
             key=("-SCENARIO_ACHIEVEMENT_CHECK_R-", i),
         ),
         sg.Button(
-            image_filename="./assets/images/trash.png",
+            image_data=trash_image(),
             key=("-SCENARIO_ACHIEVEMENT_DEL-", i),
         ),
     ]
 
 
+def achievement_row_layout(i):
+    return sg.Column(
+        [achievement_layout(i)],
+        p=0,
+        visible=False,
+        key=("-SCENARIO_ACHIEVEMENT-", i),
+    )
+
+
 def init_window(manager: ScenarioManager) -> sg.Window:
     sg.theme("LightBlue")
     TEXT_LEN = 14
     IN_LEN = ROW_WIDTH - TEXT_LEN
 
-    achievements = sorted(manager.achievements, key=lambda x: x.name)
+    # Copy, the listboxes must not see achievements added later on
+    achievements = list(manager.achievements)
+    scenarios_short = manager.short()
 
     general_layout = [
         [
             sg.Text("Szenario auswählen"),
             sg.OptionMenu(
-                values=manager.short(),
-                default_value=manager.short()[0],
+                values=scenarios_short,
+                default_value=scenarios_short[0],
                 key="-VISUALIZE_SELECTOR-",
             ),
             sg.Button("Visualisieren", key="-VISUALIZE_RENDER-"),
@@ -100,28 +124,18 @@ def init_window(manager: ScenarioManager) -> sg.Window:
         [
             sg.In(s=int(ROW_WIDTH * 0.45), key="-GENERAL_WORLD_STATUS_NAME-"),
             sg.OptionMenu(
-                values=[a.name for a in AchievementType],
+                values=ACHIEVEMENT_TYPE_NAMES,
                 key="-GENERAL_WORLD_STATUS_TYPE-",
                 default_value=AchievementType.GROUP.name,
             ),
             sg.OptionMenu(
-                values=[a.name for a in AchievementStatus],
+                values=ACHIEVEMENT_STATUS_NAMES,
                 key="-GENERAL_WORLD_STATUS_STATUS-",
                 default_value=AchievementStatus.CLOSED.name,
             ),
         ],
     ]
 
-    achievements_layout = [
-        sg.Column(
-            [achievement_layout(i)],
-            p=0,
-            visible=False,
-            key=("-SCENARIO_ACHIEVEMENT-", i),
-        )
-        for i in range(MAX_ACHIEVEMENTS)
-    ]
-
     scenario_details_layout = [
         [
             sg.Text("Nr.", s=TEXT_LEN),
@@ -141,6 +155,8 @@ def init_window(manager: ScenarioManager) -> sg.Window:
                 select_mode=sg.LISTBOX_SELECT_MODE_MULTIPLE,
                 key="-SCENARIO_REQUIREMENTS-",
                 no_scrollbar=True,
+                # The values never change, so their indices are mapped once
+                metadata={req: i for i, req in enumerate(achievements)},
             ),
         ],
         [
@@ -154,10 +170,10 @@ def init_window(manager: ScenarioManager) -> sg.Window:
         [
             sg.Text("Schwierigkeitsgrad", s=TEXT_LEN),
             sg.Listbox(
-                values=[d.name for d in Difficulty],
+                values=DIFFICULTY_NAMES,
                 key="-SCENARIO_DIFFICULTY-",
                 no_scrollbar=True,
-                s=(IN_LEN, len([d.name for d in Difficulty])),
+                s=(IN_LEN, len(DIFFICULTY_NAMES)),
             ),
         ],
         [sg.Text("Anläufe", s=TEXT_LEN), sg.In(s=IN_LEN, key="-SCENARIO_ATTEMPTS-")],
@@ -169,11 +185,7 @@ def init_window(manager: ScenarioManager) -> sg.Window:
             sg.Text("Erfolge", s=TEXT_LEN),
             sg.Button("Hinzufügen", key="-SCENARIO_ACHIEVEMENTS_ADD-"),
         ],
-        [
-            sg.Column(
-                [[l] for l in achievements_layout], key="-SCENARIO_ACHIEVEMENTS-", p=0
-            )
-        ],
+        [sg.Column([[achievement_row_layout(0)]], key="-SCENARIO_ACHIEVEMENTS-", p=0)],
         [sg.Text("Beschreibung")],
         [
             sg.Multiline(
@@ -188,8 +200,8 @@ def init_window(manager: ScenarioManager) -> sg.Window:
         [
             sg.Text("Szenario auswählen"),
             sg.OptionMenu(
-                values=manager.short(),
-                default_value=manager.short()[0],
+                values=scenarios_short,
+                default_value=scenarios_short[0],
                 key="-SCENARIO_SELECTOR-",
             ),
             sg.Button("Laden", key="-SCENARIO_LOAD-", s=6),
@@ -214,6 +226,7 @@ def init_window(manager: ScenarioManager) -> sg.Window:
                     ]
                 ],
                 key="-TAB_GROUP-",
+                enable_events=True,
             )
         ],
         [
@@ -222,9 +235,37 @@ def init_window(manager: ScenarioManager) -> sg.Window:
         ],
     ]
 
-    return sg.Window(
+    window = sg.Window(
         APP_NAME, layout, font=f"Default {FONT_SIZE['default']}"
     ).finalize()
+    window.metadata = {
+        "save_pending": False,
+        "pbar_dirty": False,
+        "visible_achievements": set(),
+        "achievement_rows": [achievement_elements(window, 0)],
+    }
+    return window
+
+
+def achievement_elements(window, i):
+    return {
+        "row": window[("-SCENARIO_ACHIEVEMENT-", i)],
+        "name": window[("-SCENARIO_ACHIEVEMENT_NAME-", i)],
+        "type": window[("-SCENARIO_ACHIEVEMENT_TYPE-", i)],
+        "status": window[("-SCENARIO_ACHIEVEMENT_STATUS-", i)],
+        "check_a": window[("-SCENARIO_ACHIEVEMENT_CHECK_A-", i)],
+    }
+
+
+def achievement_row(window, i):
+    rows = window.metadata["achievement_rows"]
+    while len(rows) <= i:
+        # Rows are only created once they are needed
+        window.extend_layout(
+            window["-SCENARIO_ACHIEVEMENTS-"], [[achievement_row_layout(len(rows))]]
+        )
+        rows.append(achievement_elements(window, len(rows)))
+    return rows[i]
 
 
 def update_pbar(window, manager):
@@ -233,13 +274,23 @@ def update_pbar(window, manager):
     )
     window["-PBAR_LOCATIONS-"].update_bar(len(manager))
 
-    num_played = len([s for s in manager.values() if s.played])
+    num_played = manager.played_count
     window["-PBAR_PLAYED_PERCENTAGE-"].update(
         f"{num_played}/{config.COUNT_SCENARIOS} ({100 * num_played / config.COUNT_SCENARIOS:.2f} %)"
     )
     window["-PBAR_PLAYED-"].update_bar(num_played)
 
 
+def get_achievement(values, i) -> Achievement:
+    name = values[("-SCENARIO_ACHIEVEMENT_NAME-", i)]
+    if not name.strip():
+        # Return None for rows left empty
+        return None
+    type = values[("-SCENARIO_ACHIEVEMENT_TYPE-", i)]
+    status = values[("-SCENARIO_ACHIEVEMENT_STATUS-", i)]
+    return Achievement(name, AchievementType[type], AchievementStatus[status])
+
+
 def get_scenario(window, values) -> Scenario:
     id = values["-SCENARIO_ID-"]
     if not id.strip():
@@ -247,12 +298,15 @@ def get_scenario(window, values) -> Scenario:
         return None
     name = values["-SCENARIO_NAME-"]
     aim = values["-SCENARIO_AIM-"]
-    successors = [succ.strip() for succ in values["-SCENARIO_SUCCESSORS-"].split(",")]
-    predecessors = [
-        pre.split()[1]
-        for pre in window["-SCENARIO_PREDECESSORS-"].DisplayText.split(",")
-        if len(pre.split()) > 1
-    ]
+    successors = {succ.strip() for succ in values["-SCENARIO_SUCCESSORS-"].split(",")}
+    predecessors = {
+        parts[1]
+        for parts in (
+            pre.split()
+            for pre in window["-SCENARIO_PREDECESSORS-"].DisplayText.split(",")
+        )
+        if len(parts) > 1
+    }
     difficulty = (
         Difficulty[values["-SCENARIO_DIFFICULTY-"][0]]
         if values["-SCENARIO_DIFFICULTY-"]
@@ -263,22 +317,14 @@ def get_scenario(window, values) -> Scenario:
     rewards = values["-SCENARIO_REWARDS-"].split("\n")
     requirements = values["-SCENARIO_REQUIREMENTS-"]
     achievements = []
-    for i in range(MAX_ACHIEVEMENTS):
-        if (
-            window[("-SCENARIO_ACHIEVEMENT-", i)].visible
-            and values[("-SCENARIO_ACHIEVEMENT_NAME-", i)].strip()
-        ):
-            type = values[("-SCENARIO_ACHIEVEMENT_TYPE-", i)]
-            status = values[("-SCENARIO_ACHIEVEMENT_STATUS-", i)]
-            achievement = Achievement(
-                values[("-SCENARIO_ACHIEVEMENT_NAME-", i)],
-                AchievementType[type],
-                AchievementStatus[status],
-            )
-            if values[("-SCENARIO_ACHIEVEMENT_CHECK_A-"), i]:
-                achievements.append(achievement)
-            else:
-                requirements.append(achievement)
+    for i in sorted(window.metadata["visible_achievements"]):
+        achievement = get_achievement(values, i)
+        if not achievement:
+            continue
+        if values[("-SCENARIO_ACHIEVEMENT_CHECK_A-", i)]:
+            achievements.append(achievement)
+        else:
+            requirements.append(achievement)
     played = values["-SCENARIO_PLAYED-"]
 
     return Scenario(
@@ -308,59 +354,76 @@ def reset_scenario(window):
     window["-SCENARIO_DESCRIPTION-"].update("")
     window["-SCENARIO_REWARDS-"].update("")
     window["-SCENARIO_PLAYED-"].update(True)
-    [hide_achievement(window, i) for i in range(MAX_ACHIEVEMENTS)]
+    hide_achievements(window)
 
 
 def load_scenario(window, manager, scenario):
-    reset_scenario(window)
+    # Write every field exactly once instead of resetting the form first
     window["-SCENARIO_ID-"].update(scenario.id)
     window["-SCENARIO_PLAYED-"].update(scenario.played)
-    if scenario.name:
-        window["-SCENARIO_NAME-"].update(scenario.name)
-    if scenario.aim:
-        window["-SCENARIO_AIM-"].update(scenario.aim)
+    window["-SCENARIO_NAME-"].update(scenario.name or "")
+    window["-SCENARIO_AIM-"].update(scenario.aim or "")
 
     window["-SCENARIO_SUCCESSORS-"].update(", ".join(scenario.successors))
     window["-SCENARIO_PREDECESSORS-"].update(
         str([manager[pre].short_formatted() for pre in scenario.predecessors])
     )
-    if scenario.difficulty:
-        window["-SCENARIO_DIFFICULTY-"].update(set_to_index=scenario.difficulty.value)
-    if scenario.attempts:
-        window["-SCENARIO_ATTEMPTS-"].update(scenario.attempts)
-    if scenario.description:
-        window["-SCENARIO_DESCRIPTION-"].update(scenario.description)
+    window["-SCENARIO_DIFFICULTY-"].update(
+        set_to_index=scenario.difficulty.value if scenario.difficulty else -1
+    )
+    window["-SCENARIO_ATTEMPTS-"].update(scenario.attempts or "")
+    window["-SCENARIO_DESCRIPTION-"].update(scenario.description or "")
     window["-SCENARIO_REWARDS-"].update("\n".join(scenario.rewards))
     requirements_list = window["-SCENARIO_REQUIREMENTS-"]
+    requirement_index = requirements_list.metadata
     requirements_list.update(
         set_to_index=[
-            requirements_list.Values.index(req)
+            requirement_index[req]
             for req in scenario.requirements
-            if req in requirements_list.Values
+            if req in requirement_index
         ]
     )
 
+    # Keep rows that stay in use visible, toggling visibility repacks the layout
+    visible = window.metadata["visible_achievements"]
+    for i in list(visible):
+        if i >= len(scenario.achievements):
+            hide_achievement(window, i)
     for i, achievement in enumerate(scenario.achievements):
-        unhide_achievement(window)
-        window[("-SCENARIO_ACHIEVEMENT_NAME-", i)].update(achievement.name)
-        window[("-SCENARIO_ACHIEVEMENT_TYPE-", i)].update(achievement.type.name)
-        window[("-SCENARIO_ACHIEVEMENT_STATUS-", i)].update(achievement.status.name)
+        if i not in visible:
+            unhide_achievement(window, i)
+        row = achievement_row(window, i)
+        row["name"].update(achievement.name)
+        row["type"].update(achievement.type.name)
+        row["status"].update(achievement.status.name)
+        row["check_a"].update(True)
+
+
+def unhide_achievement(window, i):
+    achievement_row(window, i)["row"].update(visible=True)
+    window.metadata["visible_achievements"].add(i)
 
 
-def unhide_achievement(window):
+def unhide_next_achievement(window):
     for i in range(MAX_ACHIEVEMENTS):
-        elem = window[("-SCENARIO_ACHIEVEMENT-", i)]
-        if not elem.visible:
-            elem.update(visible=True)
+        if i not in window.metadata["visible_achievements"]:
+            unhide_achievement(window, i)
             break
 
 
 def hide_achievement(window, i):
-    elem = window[("-SCENARIO_ACHIEVEMENT-", i)]
-    elem.update(visible=False)
-    window[("-SCENARIO_ACHIEVEMENT_NAME-", i)].update("")
-    window[("-SCENARIO_ACHIEVEMENT_CHECK_A-", i)].update(True)
-    window[("-SCENARIO_ACHIEVEMENT_CHECK_R-", i)].update(False)
+    row = window.metadata["achievement_rows"][i]
+    row["row"].update(visible=False)
+    row["name"].update("")
+    # Selecting one radio of the group clears the other
+    row["check_a"].update(True)
+    window.metadata["visible_achievements"].discard(i)
+
+
+def hide_achievements(window):
+    # Hidden rows are already cleared, so only the visible ones need a reset
+    for i in list(window.metadata["visible_achievements"]):
+        hide_achievement(window, i)
 
 
 def get_scenario_id(values):
@@ -372,7 +435,7 @@ def save_world_status(
 ) -> None:
     manager.world_status = values["-GENERAL_WORLD_STATUS-"]
     add_world_status(window, values, manager)
-    manager.to_file(config.SCENARIO_DATABASE)
+    window.metadata["save_pending"] = True
 
 
 def add_world_status(
@@ -397,8 +460,98 @@ def save_scenario(window: sg.Window, values: Dict[any, any], manager: ScenarioMa
 
 
 def update(window, manager):
-    manager.to_file(config.SCENARIO_DATABASE)
-    update_pbar(window, manager)
+    # Saving and refreshing the progress bars is deferred until the window is
+    # idle, so bursts of edits are handled only once
+    window.metadata["save_pending"] = True
+    window.metadata["pbar_dirty"] = True
+
+
+def refresh_pbar(window, values, manager):
+    # The progress bars live on the general tab, so redraw them only when shown
+    if window.metadata["pbar_dirty"] and window["-TAB_GROUP-"].get() == "Allgemein":
+        update_pbar(window, manager)
+        window.metadata["pbar_dirty"] = False
+
+
+def flush_pending_save(window, manager):
+    if window.metadata["save_pending"]:
+        manager.to_file(config.SCENARIO_DATABASE)
+        window.metadata["save_pending"] = False
+
+
+def render_scenario_tree(window, values, manager):
+    try:
+        manager.render_scenario_tree(
+            config.SCENARIO_TREE,
+            values["-VISUALIZE_SELECTOR-"].split()[1],
+            config.SCENARIO_TREE_FORMAT,
+            config.VISUALIZE_MAX_HOPS,
+        )
+    except ScenarioNotFoundException as e:
+        messagebox.showerror("Fehler", str(e))
+
+
+def render_tree(window, values, manager):
+    manager.render_tree(config.SCENARIO_TREE, config.SCENARIO_TREE_FORMAT)
+
+
+def load_selected_scenario(window, values, manager):
+    scenario_id = get_scenario_id(values)
+    load_scenario(window, manager, manager[scenario_id])
+
+
+def clear_scenario(window, values, manager):
+    reset_scenario(window)
+
+
+def add_achievement(window, values, manager):
+    unhide_next_achievement(window)
+
+
+def delete_achievement(window, values, manager, i):
+    hide_achievement(window, i)
+
+
+def save_and_update_scenario(window, values, manager):
+    save_scenario(window, values, manager)
+    update(window, manager)
+
+
+def complete_scenario(window, values, manager):
+    scenario = get_scenario(window, values)
+    if scenario:
+        # Mark as played before adding so the played count stays correct
+        scenario.played = True
+        manager.add_scenario(scenario)
+        window["-SCENARIO_PLAYED-"].update(True)
+        for achievement in scenario.achievements:
+            manager.add_world_status(achievement)
+        update(window, manager)
+
+
+def delete_selected_scenario(window, values, manager):
+    scenario_id = get_scenario_id(values)
+    manager.remove_scenario(scenario_id)
+    update(window, manager)
+
+
+EVENT_HANDLERS = {
+    "-VISUALIZE_RENDER-": render_scenario_tree,
+    "-VISUALIZE_RENDER_ALL-": render_tree,
+    "-SCENARIO_LOAD-": load_selected_scenario,
+    "-SCENARIO_RESET-": clear_scenario,
+    "-SCENARIO_ACHIEVEMENTS_ADD-": add_achievement,
+    "-SCENARIO_SAVE-": save_and_update_scenario,
+    "-SCENARIO_DONE-": complete_scenario,
+    "-SCENARIO_DELETE-": delete_selected_scenario,
+    "-GENERAL_SAVE-": save_world_status,
+    "-TAB_GROUP-": refresh_pbar,
+}
+
+# Handlers for events keyed by (event, row index)
+ROW_EVENT_HANDLERS = {
+    "-SCENARIO_ACHIEVEMENT_DEL-": delete_achievement,
+}
 
 
 def main():
@@ -407,61 +560,30 @@ def main():
     update_pbar(window, manager)
 
     # Event Loop to process "events" and get the "values" of the inputs
-    while True:
-        event, values = window.read()
-        if event == "-EXIT-" or event == sg.WIN_CLOSED:
-            break
-        elif event == "-EXIT_SAVE-":
-            tab = window["-TAB_GROUP-"].get()
-            if tab == "Allgemein":
-                save_world_status(window, values, manager)
-            elif tab == "Szenario - Details":
-                save_scenario(window, values, manager)
-                update(window, manager)
-            break
-        elif event == "-VISUALIZE_RENDER-":
-            try:
-                manager.render_scenario_tree(
-                    config.SCENARIO_TREE,
-                    values["-VISUALIZE_SELECTOR-"].split()[1],
-                    config.SCENARIO_TREE_FORMAT,
-                    config.VISUALIZE_MAX_HOPS,
-                )
-            except ScenarioNotFoundException as e:
-                messagebox.showerror("Fehler", str(e))
-
-        elif event == "-VISUALIZE_RENDER_ALL-":
-            manager.render_tree(config.SCENARIO_TREE, config.SCENARIO_TREE_FORMAT)
-        elif event == "-SCENARIO_LOAD-":
-            scenario_id = get_scenario_id(values)
-            load_scenario(window, manager, manager[scenario_id])
-        elif event == "-SCENARIO_RESET-":
-            reset_scenario(window)
-        elif event == "-SCENARIO_ACHIEVEMENTS_ADD-":
-            unhide_achievement(window)
-        elif isinstance(event, tuple) and event[0] == "-SCENARIO_ACHIEVEMENT_DEL-":
-            hide_achievement(window, event[1])
-        elif event == "-SCENARIO_SAVE-":
-            save_scenario(window, values, manager)
-            update(window, manager)
-        elif event == "-SCENARIO_DONE-":
-            scenario = save_scenario(window, values, manager)
-            if scenario:
-                scenario.played = True
-                window['-SCENARIO_PLAYED-'].update(True)
-                [
-                    manager.add_world_status(achievement)
-                    for achievement in scenario.achievements
-                ]
-                update(window, manager)
-        elif event == "-SCENARIO_DELETE-":
-            scenario_id = get_scenario_id(values)
-            manager.remove_scenario(scenario_id)
-            update(window, manager)
-        elif event == "-GENERAL_SAVE-":
-            save_world_status(window, values, manager)
-
-    window.close()
+    try:
+        while True:
+            timeout = config.SAVE_DELAY_MS if window.metadata["save_pending"] else None
+            event, values = window.read(timeout=timeout)
+            if event == sg.TIMEOUT_EVENT:
+                flush_pending_save(window, manager)
+                refresh_pbar(window, values, manager)
+            elif event == "-EXIT-" or event == sg.WIN_CLOSED:
+                break
+            elif event == "-EXIT_SAVE-":
+                tab = window["-TAB_GROUP-"].get()
+                if tab == "Allgemein":
+                    save_world_status(window, values, manager)
+                elif tab == "Szenario - Details":
+                    save_and_update_scenario(window, values, manager)
+                break
+            elif type(event) is tuple and event[0] in ROW_EVENT_HANDLERS:
+                ROW_EVENT_HANDLERS[event[0]](window, values, manager, event[1])
+            elif event in EVENT_HANDLERS:
+                EVENT_HANDLERS[event](window, values, manager)
+    finally:
+        # Also on errors, so edits still waiting for the save delay are kept
+        flush_pending_save(window, manager)
+        window.close()
 
 
 if __name__ == "__main__":
@@ -4,4 +4,6 @@ SCENARIO_TREE_FORMAT = "svg"
 
 VISUALIZE_MAX_HOPS = 6
 
+SAVE_DELAY_MS = 500
+
 COUNT_SCENARIOS = 95
@@ -2,13 +2,21 @@ from __future__ import annotations
 
 import graphviz
 import json
-import warnings
 import os
+import stat
+import tempfile
 
+from bisect import insort
+from collections import defaultdict, deque
 from dataclasses import dataclass, field
-from dataclasses_json import dataclass_json
 from enum import Enum
-from typing import List, Dict, Set
+from itertools import chain
+from typing import List, Dict, Set, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class ScenarioNotFoundException(Exception):
@@ -34,31 +42,67 @@ class AchievementStatus(Enum):
     CLOSED = 1
 
 
-@dataclass_json
-@dataclass
+# Members by their stored value, to decode without calling the Enum
+DIFFICULTY_BY_VALUE = {d.value: d for d in Difficulty}
+ACHIEVEMENT_TYPE_BY_VALUE = {t.value: t for t in AchievementType}
+ACHIEVEMENT_STATUS_BY_VALUE = {s.value: s for s in AchievementStatus}
+
+
+def achievement_sort_key(achievement: Achievement):
+    # Full key, the set the achievements are collected in has no stable order
+    return achievement.name, achievement.type.value, achievement.status.value
+
+
+@dataclass(frozen=True, slots=True)
 class Achievement:
     name: str
     type: AchievementType
     status: AchievementStatus
+    # Always derived from the fields above in __post_init__. String hashes differ
+    # between processes, so __reduce__ rebuilds both for copies and unpickling
+    _hash: int = field(init=False, repr=False, compare=False)
+    _label: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Achievements key the providers index and the world status, hash once
+        object.__setattr__(self, "_hash", hash((self.name, self.type, self.status)))
+        # Frozen, so the edge and list label never changes either
+        object.__setattr__(
+            self, "_label", f"{self.name} ({self.type.name}) {self.status.name}"
+        )
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self):
+        # Only the fields, the caches are computed again by __post_init__
+        return type(self), (self.name, self.type, self.status)
 
     def __str__(self) -> str:
-        return f"{self.name} ({self.type.name}) {self.status.name}"
+        return self._label
 
     def __repr__(self) -> str:
-        return self.__str__()
+        return self._label
 
-    def __hash__(self) -> int:
-        return hash((self.name, self.type.name, self.status.name))
+    def serialize(self) -> Dict:
+        return {"name": self.name, "type": self.type.value, "status": self.status.value}
+
+    @classmethod
+    def deserialize(cls, data: Dict) -> Achievement:
+        return cls(
+            data["name"],
+            ACHIEVEMENT_TYPE_BY_VALUE[data["type"]],
+            ACHIEVEMENT_STATUS_BY_VALUE[data["status"]],
+        )
 
 
-@dataclass_json
 @dataclass
 class Scenario:
     id: str
     name: str = None
     aim: str = None
-    successors: Set[str] = field(default_factory=list)
-    predecessors: Set[str] = field(default_factory=list)
+    successors: Set[str] = field(default_factory=set)
+    predecessors: Set[str] = field(default_factory=set)
     difficulty: Difficulty = None
     attempts: int = None
     description: str = None
@@ -67,11 +111,72 @@ class Scenario:
     requirements: List[Achievement] = field(default_factory=list)
     played: bool = False
 
+    def __setattr__(self, name, value) -> None:
+        # Changing a field invalidates the cached display strings
+        if not name.startswith("_"):
+            self.__dict__["_formatted"] = None
+            self.__dict__["_short_formatted"] = None
+        super().__setattr__(name, value)
+
     def formatted(self):
-        return f"Nr. {self.id} {self.name}\nVoraussetzungen: {self.requirements}\nZiel: {self.aim}\nVorgänger: {self.predecessors}\nNachfolger: {self.successors}\nSchwierigkeit: {self.difficulty.name if self.difficulty else None}, Versuche: {self.attempts}\nBelohnungen: {self.rewards}\nErfolge: {self.achievements}\nNeue Orte: {self.successors}\n{self.description}"
+        if self._formatted is None:
+            self._formatted = f"Nr. {self.id} {self.name}\nVoraussetzungen: {self.requirements}\nZiel: {self.aim}\nVorgänger: {self.predecessors}\nNachfolger: {self.successors}\nSchwierigkeit: {self.difficulty.name if self.difficulty else None}, Versuche: {self.attempts}\nBelohnungen: {self.rewards}\nErfolge: {self.achievements}\nNeue Orte: {self.successors}\n{self.description}"
+        return self._formatted
 
     def short_formatted(self):
-        return f"Nr. {self.id} {self.name if self.name else ''}"
+        if self._short_formatted is None:
+            self._short_formatted = f"Nr. {self.id} {self.name if self.name else ''}"
+        return self._short_formatted
+
+    def serialize(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "aim": self.aim,
+            # Sorted, so saving the same scenario always writes the same file
+            "successors": sorted(self.successors),
+            "predecessors": sorted(self.predecessors),
+            "difficulty": self.difficulty.value if self.difficulty else None,
+            "attempts": self.attempts,
+            "description": self.description,
+            "rewards": list(self.rewards),
+            "achievements": [
+                achievement.serialize() for achievement in self.achievements
+            ],
+            "requirements": [
+                requirement.serialize() for requirement in self.requirements
+            ],
+            "played": self.played,
+        }
+
+    @classmethod
+    def deserialize(cls, data: Dict) -> Scenario:
+        # Filled in directly, __init__ and __setattr__ cost more than the
+        # decoding itself for the few fields of a scenario
+        scenario = object.__new__(cls)
+        scenario.__dict__.update(
+            id=data["id"],
+            name=data.get("name"),
+            aim=data.get("aim"),
+            successors=set(data.get("successors", ())),
+            predecessors=set(data.get("predecessors", ())),
+            difficulty=DIFFICULTY_BY_VALUE.get(data.get("difficulty")),
+            attempts=data.get("attempts"),
+            description=data.get("description"),
+            rewards=list(data.get("rewards", ())),
+            achievements=[
+                Achievement.deserialize(achievement)
+                for achievement in data.get("achievements", ())
+            ],
+            requirements=[
+                Achievement.deserialize(requirement)
+                for requirement in data.get("requirements", ())
+            ],
+            played=data.get("played", False),
+            _formatted=None,
+            _short_formatted=None,
+        )
+        return scenario
 
 
 class ScenarioManager:
@@ -80,35 +185,55 @@ class ScenarioManager:
     ) -> None:
         self.scenarios = scenarios
         self.world_status = world_status
-        self.achievements = self.__all_achievements()
+        self._achievements = None
+        self._known_achievements = None
         self.__link_scenarios()
+        self.played_count = sum(
+            1 for scenario in self.scenarios.values() if scenario.played
+        )
+        self.__invalidate_caches()
+
+    def __invalidate_caches(self):
+        self._sorted_scenarios = None
+        self._short = None
+        self._providers = None
+
+    def __achievement_providers(self) -> Dict[Achievement, List[Scenario]]:
+        # Scenarios by the achievements they grant, for the requirement edges
+        if self._providers is None:
+            self._providers = defaultdict(list)
+            for scenario in self.scenarios.values():
+                for achievement in scenario.achievements:
+                    self._providers[achievement].append(scenario)
+        return self._providers
+
+    @property
+    def achievements(self) -> List[Achievement]:
+        # Collected lazily, sorted by name and kept until a scenario is removed
+        if self._achievements is None:
+            self._known_achievements = self.__all_achievements()
+            self._achievements = sorted(
+                self._known_achievements, key=achievement_sort_key
+            )
+        return self._achievements
 
     def __all_achievements(self):
-        achievements = set(
-            [
-                achievement
-                for scenario in self.scenarios.values()
-                for achievement in scenario.achievements
-            ]
-        )
-        requirements = set(
-            [
-                requirement
-                for scenario in self.scenarios.values()
-                for requirement in scenario.requirements
-            ]
-        )
-        return list(achievements.union(requirements).union(self.world_status))
+        achievements = set(self.world_status)
+        for scenario in self.scenarios.values():
+            achievements.update(scenario.achievements)
+            achievements.update(scenario.requirements)
+        return achievements
 
     def __link_scenarios(self):
+        scenarios = self.scenarios
         new_scenarios = []
-        for scenario in self.scenarios.values():
+        for scenario in scenarios.values():
             for successor_id in scenario.successors:
                 if not successor_id.isnumeric():
                     continue
-                if successor_id in self.scenarios:
+                successor = scenarios.get(successor_id)
+                if successor is not None:
                     # Link successor scenario with predecessor
-                    successor = self.scenarios[successor_id]
                     successor.predecessors.add(scenario.id)
                 else:
                     # Successor scenario not exists yet and thus will be created
@@ -117,75 +242,103 @@ class ScenarioManager:
                     )
 
         for scenario in new_scenarios:
-            self.scenarios[scenario.id] = scenario
+            scenarios[scenario.id] = scenario
 
     def add_scenario(self, scenario: Scenario) -> None:
         if not scenario:
             return
-        self.scenarios[scenario.id] = scenario
-        for achievement in scenario.achievements:
-            if achievement not in self.achievements:
-                self.achievements.append(achievement)
-        for requirement in scenario.requirements:
-            if requirement not in self.achievements:
-                self.achievements.append(requirement)
+        self[scenario.id] = scenario
+        if self._achievements is None:
+            return
+        for achievement in chain(scenario.achievements, scenario.requirements):
+            if achievement not in self._known_achievements:
+                self._known_achievements.add(achievement)
+                insort(self._achievements, achievement, key=achievement_sort_key)
 
     def remove_scenario(self, scenario_id: str) -> None:
+        if self.scenarios[scenario_id].played:
+            self.played_count -= 1
         del self.scenarios[scenario_id]
-        self.achievements = self.__all_achievements()
+        self.__invalidate_caches()
+        self._achievements = None
+        self._known_achievements = None
+
+    @property
+    def world_status(self) -> Tuple[Achievement, ...]:
+        # Read-only snapshot, change it through add/remove_world_status
+        return tuple(self._world_status_by_name.values())
+
+    @world_status.setter
+    def world_status(self, world_status: List[Achievement]) -> None:
+        # The world status holds one status per achievement name. Of several
+        # given statuses with the same name only the last one is kept
+        self._world_status_by_name = {
+            achievement.name: achievement for achievement in world_status
+        }
 
     def add_world_status(self, achievement: Achievement) -> None:
-        if achievement not in self.world_status:
-            for del_achievement in self.world_status:
-                if del_achievement.name == achievement.name:
-                    self.world_status.remove(del_achievement)
-
-            self.world_status.append(achievement)
+        if self._world_status_by_name.get(achievement.name) != achievement:
+            # Replaced statuses move to the end, like newly added ones
+            self._world_status_by_name.pop(achievement.name, None)
+            self._world_status_by_name[achievement.name] = achievement
 
     def remove_world_status(self, achievement: Achievement) -> None:
-        self.world_status.remove(achievement)
+        if self._world_status_by_name.get(achievement.name) != achievement:
+            raise ValueError(f"{achievement} not in world status")
+        del self._world_status_by_name[achievement.name]
 
-    def render_tree(self, output_path: str, format: str = "pdf"):
+    @staticmethod
+    def __new_tree(output_path: str, format: str) -> graphviz.Digraph:
         tree = graphviz.Digraph(
             "scenario-tree",
             filename=output_path,
             node_attr={"color": "lightblue2", "style": "filled"},
             format=format,
         )
-
         tree.attr(size="7,5")
+        return tree
+
+    @staticmethod
+    def __node_adder(tree: graphviz.Digraph, format: str):
+        # Pick the label layout once per render instead of once per node
+        if format == "svg":
+            return lambda scenario, **attrs: tree.node(
+                name=scenario.id,
+                label=scenario.short_formatted(),
+                tooltip=scenario.formatted(),
+                **attrs,
+            )
+        return lambda scenario, **attrs: tree.node(
+            name=scenario.id, label=scenario.formatted(), **attrs
+        )
+
+    def render_tree(self, output_path: str, format: str = "pdf"):
+        tree = self.__new_tree(output_path, format)
+        add_node = self.__node_adder(tree, format)
+        providers = self.__achievement_providers()
+        world_status = set(self.world_status)
         edges = {}
         for scenario in self.scenarios.values():
-            if format != "svg":
-                tree.node(name=scenario.id, label=scenario.formatted())
-            else:
-                tree.node(
-                    name=scenario.id,
-                    label=scenario.short_formatted(),
-                    tooltip=scenario.formatted(),
-                )
-
+            color = None
             if not scenario.played:
                 # color node for better visuals
-                if any(req in self.world_status for req in scenario.requirements):
+                if not world_status.isdisjoint(scenario.requirements):
                     color = "lightgreen"
                 else:
                     color = "lavenderblush3"
 
-                node_repr = tree.body[-1]
-                node_repr = node_repr[:-2] + f" color={color}" + node_repr[-2:]
-                tree.body[-1] = node_repr
+            add_node(scenario, color=color)
 
+            if not scenario.played:
                 # also show its requirements
                 for requirement in scenario.requirements:
-                    for pre in self.scenarios.values():
-                        if requirement in pre.achievements:
-                            edges[(pre.id, scenario.id)] = str(requirement)
+                    label = str(requirement)
+                    for pre in providers.get(requirement, ()):
+                        edges[(pre.id, scenario.id)] = label
 
             for successor in scenario.successors:
                 if successor.isnumeric() and successor:
-                    if (scenario.id, successor) not in edges:
-                        edges[(scenario.id, successor)] = None
+                    edges.setdefault((scenario.id, successor), None)
 
         for (e_from, e_to), label in edges.items():
             tree.edge(e_from, e_to, label=label)
@@ -204,50 +357,43 @@ class ScenarioManager:
             os.path.splitext(output_path)[1],
         )
 
-        tree = graphviz.Digraph(
-            "scenario-tree",
-            filename=output_path,
-            node_attr={"color": "lightblue2", "style": "filled"},
-            format=format,
-        )
-        tree.attr(size="7,5")
+        tree = self.__new_tree(output_path, format)
         tree.edge_attr.update(fontsize="11")
+        add_node = self.__node_adder(tree, format)
 
-        work = [(self.scenarios[scenario_id], 0)]
+        providers = self.__achievement_providers()
+        work = deque([(self.scenarios[scenario_id], 0)])
+        visited = {scenario_id}
         edges = {}
 
-        for scenario, hop in work:
+        while work:
+            scenario, hop = work.popleft()
             if max_hop and hop > max_hop:
-                continue
-            if format != "svg":
-                tree.node(name=scenario.id, label=scenario.formatted())
-            else:
-                tree.node(
-                    name=scenario.id,
-                    label=scenario.short_formatted(),
-                    tooltip=scenario.formatted(),
-                )
+                # Breadth-first order, so every remaining scenario is further away
+                break
+            add_node(scenario)
 
             for requirement in scenario.requirements:
                 if requirement.status != AchievementStatus.CLOSED:
                     continue
-                for pre in self.scenarios.values():
-                    if any(w[0].id == pre.id for w in work):
+                label = str(requirement)
+                for pre in providers.get(requirement, ()):
+                    if pre.id in visited:
                         continue
-                    if requirement in pre.achievements:
-                        work.append((pre, hop + 1))
-                        edges[(pre.id, scenario.id)] = str(requirement)
+                    work.append((pre, hop + 1))
+                    visited.add(pre.id)
+                    edges[(pre.id, scenario.id)] = label
 
             for predecessor_id in scenario.predecessors:
                 if predecessor_id not in self.scenarios:
                     raise ScenarioNotFoundException(predecessor_id)
 
                 predecessor = self.scenarios[predecessor_id]
-                if (predecessor.id, scenario.id) not in edges:
-                    edges[(predecessor.id, scenario.id)] = None
+                edges.setdefault((predecessor.id, scenario.id), None)
 
-                if all(w[0].id != predecessor_id for w in work):
+                if predecessor_id not in visited:
                     work.append((predecessor, hop + 1))
+                    visited.add(predecessor_id)
 
         for (e_from, e_to), label in edges.items():
             tree.edge(e_from, e_to, label=label)
@@ -255,12 +401,7 @@ class ScenarioManager:
         tree.view()
 
     def __str__(self) -> str:
-        return "\n".join(
-            [
-                str(scenario)
-                for scenario in sorted(self.scenarios.values(), key=lambda x: int(x.id))
-            ]
-        )
+        return "\n".join([str(scenario) for scenario in self.values()])
 
     def __repr__(self) -> str:
         return str([id for id in sorted(self.scenarios.values())])
@@ -269,48 +410,84 @@ class ScenarioManager:
         return self.scenarios[item]
 
     def __setitem__(self, key, value):
+        previous = self.scenarios.get(key)
+        if previous and previous.played:
+            self.played_count -= 1
+        if value.played:
+            self.played_count += 1
         self.scenarios[key] = value
+        self.__invalidate_caches()
 
     def __len__(self) -> int:
         return len(self.scenarios)
 
     def keys(self):
-        return sorted(self.scenarios.keys(), key=lambda x: int(x))
+        return [scenario.id for scenario in self.values()]
 
     def values(self):
-        return sorted(self.scenarios.values(), key=lambda x: int(x.id))
+        if self._sorted_scenarios is None:
+            self._sorted_scenarios = sorted(
+                self.scenarios.values(), key=lambda x: int(x.id)
+            )
+        return self._sorted_scenarios
 
     def short(self):
-        return [scenario.short_formatted() for scenario in self.values()]
+        if self._short is None:
+            self._short = [scenario.short_formatted() for scenario in self.values()]
+        return self._short
 
     def items(self):
         return self.scenarios.items()
 
     def to_json(self):
         data = {}
-        data["world_status"] = [
-            json.loads(status.to_json()) for status in self.world_status
-        ]
+        data["world_status"] = [status.serialize() for status in self.world_status]
         data["scenarios"] = [
-            json.loads(scenario.to_json()) for scenario in self.scenarios.values()
+            scenario.serialize() for scenario in self.scenarios.values()
         ]
         return data
 
     def to_file(self, path: str) -> None:
-        with open(path, "w") as f:
-            json.dump(self.to_json(), f, indent=4, sort_keys=True)
+        if orjson:
+            content = orjson.dumps(
+                self.to_json(), option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+            )
+        else:
+            # Same layout as orjson, so the file does not depend on the backend
+            content = json.dumps(
+                self.to_json(), indent=2, sort_keys=True, ensure_ascii=False
+            ).encode("utf-8")
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        # Write next to the database and swap it in, so an interrupted save
+        # never leaves a truncated file behind
+        f = tempfile.NamedTemporaryFile(
+            "wb", dir=os.path.dirname(path) or ".", delete=False
+        )
+        try:
+            with f:
+                f.write(content)
+            # The temporary file is private, keep the permissions of the database
+            os.chmod(f.name, mode)
+            os.replace(f.name, path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
 
     @staticmethod
     def from_file(path: str) -> ScenarioManager:
-        warnings.filterwarnings("ignore")
-        with open(path) as f:
-            data = json.load(f)
-            world_status = [
-                Achievement.from_json(json.dumps(status))
-                for status in data["world_status"]
-            ]
-            scenarios = {
-                scenario["id"]: Scenario.from_json(json.dumps(scenario))
-                for scenario in data["scenarios"]
-            }
+        with open(path, "rb") as f:
+            content = f.read()
+        data = orjson.loads(content) if orjson else json.loads(content)
+        world_status = [
+            Achievement.deserialize(status) for status in data["world_status"]
+        ]
+        scenarios = {
+            scenario["id"]: Scenario.deserialize(scenario)
+            for scenario in data["scenarios"]
+        }
         return ScenarioManager(scenarios, world_status)